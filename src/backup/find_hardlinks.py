@@ -1,44 +1,156 @@
 from .. import app
 
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Iterator
+from os import O_DIRECTORY, O_RDONLY, close, fstat, scandir, sep, stat
+from os import open as open_fd
+from os.path import abspath, join
+from queue import Queue
 from sys import stdout
+from threading import Thread
 from pathlib import Path
+from .hardlink_core import (
+    file_key,
+    group_hardlinks,
+    match_hardlinks,
+    sort_by_key,
+    stream_hardlinks,
+)
 
 
-def add_file_inode_to_map(
-    file_path: Path,
-    inode_map: dict[Path, int],
-    seen_inodes_map: defaultdict[int, list[Path]],
-):
+MAX_WALK_THREADS = 32
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+
+def scan_directory(
+    directory: str,
+    skip_directories: frozenset[str] = frozenset(),
+    follow_symlinks: bool = True,
+) -> tuple[list[str], list[int], list[str]]:
+    """List a single directory, returning its subdirectories and the keys and paths of its non-directory entries.
+
+    Like `Path.walk()`, symbolic links to directories are not treated as subdirectories. Subdirectories in `skip_directories` are pruned. Symbolic links to files are keyed on their target, or left out if `follow_symlinks` is False.
+    """
+    subdirectories: list[str] = []
+    keys: list[int] = []
+    paths: list[str] = []
     try:
-        inode = file_path.stat().st_ino
-        inode_map[file_path] = inode
-        seen_inodes_map[inode].append(file_path)
-    except FileNotFoundError:
+        # Entries are looked up relative to this descriptor, so the kernel does not resolve the whole path again for each one.
+        directory_fd = open_fd(directory, O_RDONLY | O_DIRECTORY)
+    except OSError:
+        return subdirectories, keys, paths
+    try:
+        # Everything listed in a directory lives on the directory's own device, so one stat covers them all.
+        device = fstat(directory_fd).st_dev
+        with scandir(directory_fd) as it:
+            for entry in it:
+                file_path = join(directory, entry.name)
+                try:
+                    if entry.is_dir():
+                        if not entry.is_symlink() and file_path not in skip_directories:
+                            subdirectories.append(file_path)
+                    elif entry.is_symlink():
+                        if follow_symlinks:
+                            file_stat = stat(entry.name, dir_fd=directory_fd)
+                            keys.append(file_key(file_stat.st_dev, file_stat.st_ino))
+                            paths.append(file_path)
+                    else:
+                        # `DirEntry.inode()` comes straight from the directory listing, only symlinks need a real stat.
+                        keys.append(file_key(device, entry.inode()))
+                        paths.append(file_path)
+                except OSError:
+                    continue
+    except OSError:
         pass
+    finally:
+        close(directory_fd)
+    return subdirectories, keys, paths
 
 
-def check_if_file_is_hardlink(
-    file_path: Path,
-    paths_per_inode: defaultdict[int, list[Path]],
-    *,
-    skip_symlinks: bool,
-    originals_directory_path: Path,
+def walk_worker(
+    directories: Queue[str | None],
+    results: Queue[tuple[list[int], list[str]] | None],
+    skip_directories: frozenset[str],
+    follow_symlinks: bool,
 ):
+    """Keep listing directories from the queue, feeding any subdirectories back into it, until a `None` is received."""
+    while (directory := directories.get()) is not None:
+        try:
+            subdirectories, keys, paths = scan_directory(
+                directory, skip_directories, follow_symlinks
+            )
+            for subdirectory in subdirectories:
+                directories.put(subdirectory)
+            results.put((keys, paths))
+        finally:
+            directories.task_done()
+
+
+def scan_files(
+    directory: str,
+    skip_directories: frozenset[str] = frozenset(),
+    follow_symlinks: bool = True,
+    walk_threads: int = 1,
+) -> Iterator[tuple[list[int], list[str]]]:
+    """Recursively yield the keys and paths of every non-directory entry below a directory, one directory at a time.
+
+    With `walk_threads` above 1, that many worker threads (at most `MAX_WALK_THREADS`) list directories concurrently from a shared queue.
+    """
+    # Below the top directory, pruning the exact skipped paths is enough. The top directory itself may lie anywhere inside one.
+    if directory in skip_directories or directory.startswith(
+        tuple(skip_dir + sep for skip_dir in skip_directories)
+    ):
+        return
+    if walk_threads <= 1:
+        stack = [directory]
+        while stack:
+            subdirectories, keys, paths = scan_directory(
+                stack.pop(), skip_directories, follow_symlinks
+            )
+            stack.extend(reversed(subdirectories))
+            yield keys, paths
+        return
+    walk_threads = min(walk_threads, MAX_WALK_THREADS)
+    directories: Queue[str | None] = Queue()
+    results: Queue[tuple[list[int], list[str]] | None] = Queue()
+    directories.put(directory)
+    workers = [
+        Thread(
+            target=walk_worker,
+            args=(directories, results, skip_directories, follow_symlinks),
+            daemon=True,
+        )
+        for _ in range(walk_threads)
+    ]
+    for worker in workers:
+        worker.start()
+
+    def finish_walk():
+        # Once every queued directory has been listed, the walk is over.
+        directories.join()
+        results.put(None)
+
+    Thread(target=finish_walk, daemon=True).start()
     try:
-        if file_path.is_symlink():
-            if skip_symlinks:
-                return
-            else:
-                file_path = file_path.resolve()
-        if file_path.is_relative_to(originals_directory_path):
-            return
-        inode = file_path.stat().st_ino
-        if inode in paths_per_inode:
-            paths_per_inode[inode].append(file_path)
-    except FileNotFoundError:
-        pass
+        while (batch := results.get()) is not None:
+            yield batch
+    finally:
+        for _ in workers:
+            directories.put(None)
+
+
+def collect_originals(
+    directory: str, *, walk_threads: int = 1
+) -> tuple[list[int], list[str]]:
+    """Collect the keys and paths of every file in the originals directory, sorted by key and then by path.
+
+    Symbolic links are followed. Originals sharing a key end up next to each other.
+    """
+    keys: list[int] = []
+    paths: list[str] = []
+    for batch_keys, batch_paths in scan_files(directory, walk_threads=walk_threads):
+        keys.extend(batch_keys)
+        paths.extend(batch_paths)
+    return sort_by_key(keys, paths)
 
 
 @app.command()
@@ -51,6 +163,8 @@ def find_hardlinks(
     skip_symlinks: bool = True,
     include_originals_in_output: bool = False,
     skip_directories: list[Path] = [],
+    walk_threads: int = 1,
+    stream_output: bool = False,
 ):
     """Find all files in the root directory that are hardlinks to files in the originals directory.
 
@@ -58,7 +172,7 @@ def find_hardlinks(
 
     :param originals_directory: The directory containing the original files. If the originals directory is a subdirectory of the root directory, it will not be counted when doing the search.
 
-    :param min_links: How many additional links need to exist outside of the source file, defaults to 1
+    :param min_links: How many additional links need to exist outside of the originals directory, defaults to 1. Originals that are only linked to other originals are never reported, and are not counted towards this.
 
     :param to_file: Write results to this file, defaults to stdout if not provided
 
@@ -69,48 +183,59 @@ def find_hardlinks(
     :param include_originals_in_output: Include the original files in the output, defaults to False. If True, the original files will be included in the output if they have at least `min_links` hardlinks outside of the originals directory.
 
     :param skip_directories: List of directories to skip when searching for hardlinks, defaults to [].
+
+    :param walk_threads: How many threads list directories concurrently, defaults to 1 and is capped at 32. Only worth raising on high-latency filesystems such as network mounts.
+
+    :param stream_output: Write each hardlink as soon as its original has `min_links` links, defaults to False. This keeps memory bounded on trees with huge numbers of hardlinks, but the output is no longer grouped by original or sorted. Otherwise, each original's hardlinks are written together, sorted by path.
     """
     if min_links < 1:
         raise ValueError("min_links must be at least 1")
+    if walk_threads < 1:
+        raise ValueError("walk_threads must be at least 1")
     if to_file is None:
         output_file = stdout
     else:
         if append_to_file:
-            output_file = open(to_file, "a")
+            output_file = open(to_file, "a", buffering=OUTPUT_BUFFER_SIZE)
         else:
-            output_file = open(to_file, "w")
-    root_directory_path = root_directory.absolute()
-    originals_directory_path = originals_directory.absolute()
-    originals_inode_map: dict[Path, int] = {}
-    paths_per_inode: defaultdict[int, list[Path]] = defaultdict(list)
-    with ThreadPoolExecutor() as executor:
-        for path, _, files in originals_directory_path.walk():
-            for file in files:
-                file_path = path / file
-                executor.submit(
-                    add_file_inode_to_map,
-                    file_path,
-                    originals_inode_map,
-                    paths_per_inode,
-                )
-    with ThreadPoolExecutor() as executor:
-        for path, _, files in root_directory_path.walk():
-            if any(path.is_relative_to(skip_dir) for skip_dir in skip_directories):
-                continue
-            for file in files:
-                file_path = path / file
-                executor.submit(
-                    check_if_file_is_hardlink,
-                    file_path,
-                    paths_per_inode,
-                    skip_symlinks=skip_symlinks,
-                    originals_directory_path=originals_directory_path,
-                )
-    for paths in paths_per_inode.values():
-        # Due to the structure, the original file will always be the first one in the list
-        original_file = paths[0]
-        if len(paths) - 1 >= min_links:
+            output_file = open(to_file, "w", buffering=OUTPUT_BUFFER_SIZE)
+    # Paths are normalized up front so that they compare equal to the plain strings built during the walk.
+    root_directory_path = abspath(root_directory)
+    originals_directory_path = abspath(originals_directory)
+    originals_keys, originals_paths = collect_originals(
+        originals_directory_path, walk_threads=walk_threads
+    )
+    # The originals directory has already been scanned, so it is pruned from the root walk along with the skipped directories.
+    skip_prefixes = frozenset(
+        {originals_directory_path}
+        | {abspath(skip_dir) for skip_dir in skip_directories}
+    )
+    root_files = scan_files(
+        root_directory_path,
+        skip_prefixes,
+        follow_symlinks=not skip_symlinks,
+        walk_threads=walk_threads,
+    )
+    if stream_output:
+        output_file.writelines(
+            stream_hardlinks(
+                originals_keys,
+                originals_paths,
+                root_files,
+                min_links=min_links,
+                include_originals=include_originals_in_output,
+            )
+        )
+        output_file.flush()
+        return
+    matched_keys, matched_paths = match_hardlinks(originals_keys, root_files)
+    output_lines: list[str] = []
+    for original_file, paths in group_hardlinks(
+        originals_keys, originals_paths, matched_keys, matched_paths
+    ):
+        if len(paths) >= min_links:
             if include_originals_in_output:
-                print(original_file, file=output_file)
-            for i in range(1, len(paths)):
-                print(paths[i], file=output_file)
+                output_lines.append(f"{original_file}\n")
+            output_lines.extend(f"{path}\n" for path in paths)
+    output_file.write("".join(output_lines))
+    output_file.flush()
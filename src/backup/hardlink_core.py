@@ -0,0 +1,98 @@
+"""Matching of files against originals, kept free of the CLI and filesystem walking so it can be compiled with mypyc."""
+
+from bisect import bisect_left
+from collections.abc import Iterable, Iterator
+
+
+def file_key(device: int, inode: int) -> int:
+    """Combine a device and inode number into a single key that is unique across filesystems."""
+    return device << 64 | inode
+
+
+def sort_by_key(keys: list[int], paths: list[str]) -> tuple[list[int], list[str]]:
+    """Sort parallel lists of keys and paths by key, then by path."""
+    # Sorting is stable, so sorting by path first leaves each key's paths in order.
+    order = sorted(range(len(paths)), key=paths.__getitem__)
+    order.sort(key=keys.__getitem__)
+    return [keys[i] for i in order], [paths[i] for i in order]
+
+
+def match_hardlinks(
+    originals_keys: list[int],
+    root_files: Iterable[tuple[list[int], list[str]]],
+) -> tuple[list[int], list[str]]:
+    """Find the root files sharing a key with an original, given batches of keys and paths.
+
+    The matches are returned as parallel lists of keys and paths, sorted by key and then by path.
+    """
+    originals_key_set = frozenset(originals_keys)
+    matched_keys: list[int] = []
+    matched_paths: list[str] = []
+    for keys, paths in root_files:
+        # Most batches hold no hardlinks at all, and `isdisjoint` rules them out without a Python-level loop.
+        if originals_key_set.isdisjoint(keys):
+            continue
+        for key, file_path in zip(keys, paths):
+            if key in originals_key_set:
+                matched_keys.append(key)
+                matched_paths.append(file_path)
+    return sort_by_key(matched_keys, matched_paths)
+
+
+def group_hardlinks(
+    originals_keys: list[int],
+    originals_paths: list[str],
+    matched_keys: list[int],
+    matched_paths: list[str],
+) -> Iterator[tuple[str, list[str]]]:
+    """Yield the source original and the matched root paths for each matched key.
+
+    The source original is the first original with the key. Other originals sharing the key are not hardlinks outside of the originals directory, so they are left out. Both sides must be sorted by key. They are walked side by side, so groups come out in key order without any lookups.
+    """
+    original = 0
+    match = 0
+    while match < len(matched_keys):
+        key = matched_keys[match]
+        # Every matched key has at least one original, so this cannot run past the end.
+        while originals_keys[original] < key:
+            original += 1
+        matches_start = match
+        while match < len(matched_keys) and matched_keys[match] == key:
+            match += 1
+        yield originals_paths[original], matched_paths[matches_start:match]
+
+
+def stream_hardlinks(
+    originals_keys: list[int],
+    originals_paths: list[str],
+    root_files: Iterable[tuple[list[int], list[str]]],
+    *,
+    min_links: int,
+    include_originals: bool,
+) -> Iterator[str]:
+    """Yield output lines for the root files, given in batches of keys and paths, as soon as their original has enough links.
+
+    Matches are only held back until their original reaches `min_links`, so at most `min_links` paths are kept per original. Lines for different originals can be interleaved.
+    """
+    originals_key_set = frozenset(originals_keys)
+    pending: dict[int, list[str]] = {}
+    flushed: set[int] = set()
+    for keys, file_paths in root_files:
+        if originals_key_set.isdisjoint(keys):
+            continue
+        for key, file_path in zip(keys, file_paths):
+            if key not in originals_key_set:
+                continue
+            if key in flushed:
+                yield f"{file_path}\n"
+                continue
+            paths = pending.setdefault(key, [])
+            paths.append(file_path)
+            # Same rule as the grouped output: only matches outside the originals directory count.
+            if len(paths) >= min_links:
+                del pending[key]
+                flushed.add(key)
+                if include_originals:
+                    original = originals_paths[bisect_left(originals_keys, key)]
+                    yield f"{original}\n"
+                yield from (f"{path}\n" for path in paths)
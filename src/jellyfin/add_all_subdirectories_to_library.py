@@ -1,4 +1,4 @@
-from asyncio import gather, run
+from asyncio import run
 from pathlib import Path
 from typing import Annotated
 
@@ -27,13 +27,6 @@ async def add_all_subdirectories_to_library_inner(
         raise ValueError(
             "Both --path-replace-from and --path-replace-to must be provided together."
         )
-    paths = {
-        dir.path.replace(path_replace_from, path_replace_to)
-        if (path_replace_from and path_replace_to)
-        else dir.path
-        for dir in scandir(parent_folder_path)
-        if dir.is_dir()
-    }
     async with JellyfinAPIClient(jellyfin_server_url, api_key=api_key) as session:
         existing_libraries = await session.get_libraries()
         library = next(
@@ -42,22 +35,19 @@ async def add_all_subdirectories_to_library_inner(
         if not library:
             raise ValueError(f"Library with name '{library_name}' not found.")
         existing_paths = set(library.Locations)
-        new_paths = paths - existing_paths
+        with scandir(parent_folder_path) as it:
+            paths = (dir.path for dir in it if dir.is_dir())
+            if path_replace_from and path_replace_to:
+                paths = (
+                    path.replace(path_replace_from, path_replace_to) for path in paths
+                )
+            new_paths = {path for path in paths if path not in existing_paths}
         if not new_paths:
             print("No new subdirectory paths to add, exiting.")
             return
         else:
-            last_path = new_paths.pop()
-            await gather(
-                *[
-                    session.add_path_to_library(
-                        library.Name, path, refresh_library=False
-                    )
-                    for path in new_paths
-                ]
-            )
-            await session.add_path_to_library(
-                library.Name, last_path, refresh_library=True
+            await session.add_paths_to_library(
+                library.Name, new_paths, refresh_library=True
             )
             print(f"Added {len(new_paths)} new paths to library '{library.Name}'.")
 
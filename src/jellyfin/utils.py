@@ -1,9 +1,12 @@
 """Utility functions for working with the Jellyfin API."""
 
+from asyncio import Semaphore, gather
+from collections.abc import Iterable
+from functools import lru_cache
 from typing import TYPE_CHECKING, Self
 from urllib.parse import quote
-from aiohttp import ClientSession
-from pydantic import BaseModel, RootModel
+from aiohttp import ClientSession, TCPConnector
+from pydantic import BaseModel, TypeAdapter
 
 
 class Library(BaseModel):
@@ -13,24 +16,44 @@ class Library(BaseModel):
     Locations: list[str]
 
 
+# Building the adapter compiles a validator, so it is done once rather than per request.
+LIBRARY_LIST_ADAPTER = TypeAdapter(list[Library])
+
+
+@lru_cache
+def build_auth_header(api_key: str) -> str:
+    """Build the value of the Authorization header for an API key."""
+    return f'MediaBrowser Token="{quote(api_key)}", Client="RandomScripts", Version="1.0", Device="PythonClient", DeviceId="PythonClient"'
+
+
 class JellyfinAPIClient(ClientSession):
     """Client for interacting with the Jellyfin API."""
 
+    MAX_CONNECTIONS = 32
+    KEEPALIVE_TIMEOUT = 300
+    MAX_CONCURRENT_PATH_ADDS = 8
+
     def __init__(self, base_url: str, *, api_key: str):
-        """Initialize the Jellyfin API client."""
-        super().__init__(base_url)
-        self.headers.update(
-            {
-                "Authorization": f'MediaBrowser Token="{quote(api_key)}", Client="RandomScripts", Version="1.0", Device="PythonClient", DeviceId="PythonClient"'
-            }
+        """Initialize the Jellyfin API client.
+
+        Connections are kept alive for a while, so that bursts of requests reuse them instead of reconnecting.
+        """
+        super().__init__(
+            base_url,
+            connector=TCPConnector(
+                limit=self.MAX_CONNECTIONS,
+                limit_per_host=self.MAX_CONNECTIONS,
+                keepalive_timeout=self.KEEPALIVE_TIMEOUT,
+            ),
+            headers={"Authorization": build_auth_header(api_key)},
         )
 
     async def get_libraries(self) -> list[Library]:
         """Get a list of libraries from the Jellyfin server."""
         async with self.get("/Library/VirtualFolders") as response:
             response.raise_for_status()
-            data = await response.json()
-            return RootModel[list[Library]].model_validate(data).root
+            # Validating the raw bytes parses and validates in a single pass, without building intermediate dicts.
+            return LIBRARY_LIST_ADAPTER.validate_json(await response.read())
 
     async def add_path_to_library(
         self, library_name: str, folder_path: str, refresh_library: bool = False
@@ -42,6 +65,33 @@ class JellyfinAPIClient(ClientSession):
         ) as response:
             response.raise_for_status()
 
+    async def add_paths_to_library(
+        self,
+        library_name: str,
+        folder_paths: Iterable[str],
+        refresh_library: bool = False,
+    ) -> None:
+        """Add several paths to a library.
+
+        Jellyfin can only add one path per request, so the paths are added with a bounded number of requests in flight. The library is refreshed at most once, after the last path has been added.
+        """
+        paths = sorted(set(folder_paths))
+        if not paths:
+            return
+        *first_paths, last_path = paths
+        semaphore = Semaphore(self.MAX_CONCURRENT_PATH_ADDS)
+
+        async def add_path(folder_path: str):
+            async with semaphore:
+                await self.add_path_to_library(
+                    library_name, folder_path, refresh_library=False
+                )
+
+        await gather(*[add_path(folder_path) for folder_path in first_paths])
+        await self.add_path_to_library(
+            library_name, last_path, refresh_library=refresh_library
+        )
+
     if TYPE_CHECKING:
 
         async def __aenter__(self) -> Self: ...